@@ -8,16 +8,26 @@ client one-by-one as they are generated.
 """
 
 import asyncio
+import atexit
+import functools
 import http.client
 import json
 import logging
 import os
+import queue
 import signal
 import sqlite3
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Callable
+from typing import Callable, Iterator
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # optional; stdlib json also accepts bytes
+    _json_loads = json.loads
 
 # ---------------------------------------------------------------------------
 # Paths
@@ -35,6 +45,15 @@ LLAMA_PORT = 8080
 # Give each command line up to 30s before giving up.
 LLM_TIMEOUT = 30.0
 
+# Once five commands are out, an Anthropic response is read on in the
+# background for up to this long so its connection can be reused.
+DRAIN_TIMEOUT = 2.0
+
+# Pooled connections idle for longer than this are closed rather than reused;
+# llama-server drops keep-alive connections after 5s idle by default. Other
+# hosts can set their own limit with ConnPool.set_idle_timeout().
+POOL_IDLE_TIMEOUT = 4.0
+
 # ---------------------------------------------------------------------------
 # Backend config  (read once at startup from environment)
 # ---------------------------------------------------------------------------
@@ -58,52 +77,84 @@ log = logging.getLogger(__name__)
 # ---------------------------------------------------------------------------
 # FTS5 retrieval (runs in thread executor)
 # ---------------------------------------------------------------------------
-_db_con: sqlite3.Connection | None = None
-_executor = ThreadPoolExecutor(max_workers=2)
+_db_local = threading.local()
+# Separate pools so a 30 s LLM stream can never delay the next FTS lookup
+_fts_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fts")
+_llm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm")
+atexit.register(_fts_executor.shutdown, wait=False, cancel_futures=True)
+atexit.register(_llm_executor.shutdown, wait=False, cancel_futures=True)
 
 
 def _get_db() -> sqlite3.Connection:
-    global _db_con
-    if _db_con is None:
+    """Return this thread's read-only connection, opening it on first use."""
+    con = getattr(_db_local, "con", None)
+    if con is None:
         if not DB_PATH.exists():
             raise FileNotFoundError(f"Knowledge base not found: {DB_PATH}")
-        _db_con = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-        _db_con.execute("PRAGMA query_only=ON")
-    return _db_con
+        con = sqlite3.connect(f"{DB_PATH.as_uri()}?mode=ro", uri=True)
+        con.execute("PRAGMA mmap_size=268435456")
+        con.execute("PRAGMA cache_size=-32768")  # 32 MiB
+        con.execute("PRAGMA temp_store=MEMORY")
+        _db_local.con = con
+    return con
+
+
+# Top-k BM25 matches are materialized first, so the stored cmd column is only
+# fetched for the handful of rows that are actually returned.
+_FTS_SQL = (
+    "WITH m AS ("
+    "SELECT rowid, bm25(commands) AS s FROM commands "
+    "WHERE commands MATCH ? ORDER BY s LIMIT ?"
+    ") "
+    "SELECT c.cmd FROM m JOIN commands c ON c.rowid = m.rowid ORDER BY m.s"
+)
 
 
-def _fts_query_sync(query: str, top_k: int = 3) -> list[str]:
-    tokens = query.strip().split()
+def _fts_lookup(query: str, top_k: int) -> list[str]:
+    # Quote every token as an FTS5 string so operators and punctuation are
+    # literal and MATCH cannot raise a syntax error; the last token becomes a
+    # prefix term served by the table's prefix index. Tokens stay separate
+    # (implicit AND) rather than one phrase, so word order doesn't matter.
+    tokens = query.replace('"', '""').split()
     if not tokens:
         return []
+    fts_expr = '"' + '" "'.join(tokens) + '"*'
     con = _get_db()
-    prefix = tokens[-1] + "*"
-    prior  = tokens[:-1]
-    fts_expr = " ".join(prior + [prefix]) if prior else prefix
-    try:
-        cur = con.execute(
-            "SELECT cmd FROM commands WHERE commands MATCH ? ORDER BY rank LIMIT ?",
-            (fts_expr, top_k),
-        )
-        rows = [r[0] for r in cur.fetchall()]
-        if rows:
-            return rows
-    except sqlite3.OperationalError:
-        pass
-    escaped = query.replace("%", r"\%").replace("_", r"\_")
     try:
-        cur = con.execute(
-            "SELECT cmd FROM commands WHERE cmd LIKE ? ESCAPE '\\' LIMIT ?",
-            (escaped + "%", top_k),
-        )
+        cur = con.execute(_FTS_SQL, (fts_expr, top_k))
         return [r[0] for r in cur.fetchall()]
     except sqlite3.OperationalError:
         return []
 
 
+# Autocomplete re-sends the same query a lot; serve repeats from memory for a
+# few seconds. History only grows, so short staleness is harmless.
+FTS_CACHE_SIZE = 256
+FTS_CACHE_TTL = 5.0
+_fts_cache: dict[tuple[str, int], tuple[float, list[str]]] = {}
+_fts_lock = threading.Lock()
+
+
+def _fts_query_sync(query: str, top_k: int = 3) -> list[str]:
+    key = (query, top_k)
+    now = time.monotonic()
+    with _fts_lock:
+        hit = _fts_cache.get(key)
+    if hit is not None and now - hit[0] < FTS_CACHE_TTL:
+        return hit[1]
+
+    result = _fts_lookup(query, top_k)
+    with _fts_lock:
+        _fts_cache.pop(key, None)
+        _fts_cache[key] = (now, result)
+        if len(_fts_cache) > FTS_CACHE_SIZE:
+            del _fts_cache[next(iter(_fts_cache))]  # oldest insertion
+    return result
+
+
 async def fts_query(query: str) -> list[str]:
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(_executor, _fts_query_sync, query)
+    return await loop.run_in_executor(_fts_executor, _fts_query_sync, query)
 
 
 # ---------------------------------------------------------------------------
@@ -136,107 +187,276 @@ http GET "https://api.binance.com/api/v3/ticker/price?symbol=ETHUSDT"
 """
 
 
-def _build_prompt(query: str, examples: list[str]) -> str:
+# Static instructions + few-shot block, identical on every request so that
+# llama.cpp can reuse the KV cache for it and only evaluate the suffix.
+_PROMPT_PREFIX = (
+    "Generate 5 different shell commands for each request. "
+    "Each command must use a different tool or approach. "
+    "Output only valid bash/zsh commands that run directly in a terminal. "
+    "Always quote URLs and strings containing special characters (?, &, =, spaces). "
+    "One command per line, no numbering, no explanations, no markdown.\n\n"
+    + _FEW_SHOT
+)
+
+
+def _build_prompt(query: str, examples: tuple[str, ...]) -> str:
+    """Per-request part of the llama prompt; always follows _PROMPT_PREFIX."""
     ex_block = "\n".join(f"$ {e}" for e in examples)
     history = f"User history:\n{ex_block}\n\n" if ex_block else ""
-    return (
-        "Generate 5 different shell commands for each request. "
-        "Each command must use a different tool or approach. "
-        "Output only valid bash/zsh commands that run directly in a terminal. "
-        "Always quote URLs and strings containing special characters (?, &, =, spaces). "
-        "One command per line, no numbering, no explanations, no markdown.\n\n"
-        + _FEW_SHOT
-        + history
-        + f"Request: {query}\nCommands:\n"
-    )
+    return history + f"Request: {query}\nCommands:\n"
+
+
+def _json_template(obj: dict, hole: str) -> tuple[bytes, bytes]:
+    """Serialize obj once and split it around the JSON encoding of hole."""
+    head, tail = json.dumps(obj).encode().split(json.dumps(hole).encode())
+    return head, tail
+
+
+# Request bodies are serialized once at import; per request only the variable
+# part is encoded and spliced in. The prefix is stored as an open JSON string
+# so the suffix can continue it without re-escaping the few-shot block.
+_LLAMA_HEAD, _LLAMA_TAIL = _json_template({
+    "prompt": "__PROMPT__",
+    "temperature": 0.7,
+    "n_predict": 250,
+    "stop": ["Request:", "Past commands:"],
+    "stream": True,
+    "cache_prompt": True,
+    "id_slot": 0,
+}, "__PROMPT__")
+_LLAMA_HEAD += json.dumps(_PROMPT_PREFIX)[:-1].encode()
+
+
+@functools.lru_cache(maxsize=256)
+def _build_payload(query: str, examples: tuple[str, ...]) -> bytes:
+    suffix = json.dumps(_build_prompt(query, examples))[1:]
+    return _LLAMA_HEAD + suffix.encode() + _LLAMA_TAIL
 
 
 # ---------------------------------------------------------------------------
-# LLM streaming (runs in thread executor)
+# HTTP connection pool
 # ---------------------------------------------------------------------------
-_http_conn: http.client.HTTPConnection | None = None
+class ConnPool:
+    """Idle keep-alive HTTP(S) connections, keyed by (host, port).
+
+    A connection is only handed back for reuse once its response has been read
+    to the end; anything interrupted mid-stream is closed and discarded so the
+    next request never sees leftover bytes. Idle connections are stored with
+    their release time and dropped once older than the host's idle timeout
+    (POOL_IDLE_TIMEOUT unless set_idle_timeout() says otherwise).
+    """
+
+    def __init__(self, max_idle: int = 2) -> None:
+        self._max_idle = max_idle
+        self._idle: dict[tuple[str, int], queue.LifoQueue] = {}
+        self._idle_timeout: dict[tuple[str, int], float] = {}
+        self._lock = threading.Lock()
+
+    def set_idle_timeout(self, host: str, port: int, seconds: float) -> None:
+        self._idle_timeout[(host, port)] = seconds
+
+    def _queue(self, host: str, port: int) -> queue.LifoQueue:
+        with self._lock:
+            q = self._idle.get((host, port))
+            if q is None:
+                q = self._idle[(host, port)] = queue.LifoQueue(self._max_idle)
+            return q
+
+    def _take_idle(self, host: str, port: int) -> tuple[float, http.client.HTTPConnection] | None:
+        """Pop the newest idle connection, closing any that have gone stale."""
+        q = self._queue(host, port)
+        limit = self._idle_timeout.get((host, port), POOL_IDLE_TIMEOUT)
+        while True:
+            try:
+                released_at, conn = q.get_nowait()
+            except queue.Empty:
+                return None
+            if time.monotonic() - released_at < limit:
+                return released_at, conn
+            conn.close()
+
+    def _put(self, conn: http.client.HTTPConnection, released_at: float) -> bool:
+        try:
+            self._queue(conn.host, conn.port).put_nowait((released_at, conn))
+            return True
+        except queue.Full:
+            return False
+
+    def acquire(
+        self, host: str, port: int, https: bool = False, fresh: bool = False
+    ) -> http.client.HTTPConnection:
+        if not fresh and (idle := self._take_idle(host, port)) is not None:
+            return idle[1]
+        cls = http.client.HTTPSConnection if https else http.client.HTTPConnection
+        conn = cls(host, port, timeout=LLM_TIMEOUT)
+        # Connect eagerly; http.client sets TCP_NODELAY on the socket so SSE
+        # chunks are not held back by Nagle.
+        conn.connect()
+        return conn
+
+    def warm(self, host: str, port: int, https: bool = False) -> None:
+        """Ensure a fresh idle connection exists so the next acquire() skips connect/TLS."""
+        idle = self._take_idle(host, port)
+        if idle is not None:
+            if not self._put(idle[1], idle[0]):
+                idle[1].close()
+            return
+        try:
+            self.release(self.acquire(host, port, https), True)
+        except OSError as e:
+            log.warning("Pre-connect to %s:%d failed: %s", host, port, e)
 
+    def release(self, conn: http.client.HTTPConnection, reusable: bool) -> None:
+        if reusable and self._put(conn, time.monotonic()):
+            return
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-def _get_http() -> http.client.HTTPConnection:
-    global _http_conn
-    if _http_conn is None:
-        _http_conn = http.client.HTTPConnection(LLAMA_HOST, LLAMA_PORT, timeout=LLM_TIMEOUT)
-    return _http_conn
 
+_pool = ConnPool()
+
+_KEEPALIVE_HEADERS = {
+    "Content-Type": "application/json",
+    "Connection": "keep-alive",
+}
+
+
+def _open_stream(
+    host: str,
+    port: int,
+    https: bool,
+    path: str,
+    payload: bytes,
+    headers: dict[str, str],
+    label: str,
+) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse] | None:
+    """POST payload on a pooled connection, retrying once on a new connection
+    if the pooled one turns out stale. Returns (conn, resp) on HTTP 200, None otherwise."""
+    headers = {**_KEEPALIVE_HEADERS, **headers, "Content-Length": str(len(payload))}
+    for attempt in range(2):
+        conn = None
+        try:
+            conn = _pool.acquire(host, port, https, fresh=attempt > 0)
+            conn.request("POST", path, body=payload, headers=headers)
+            resp = conn.getresponse()
+        except (http.client.HTTPException, OSError) as e:
+            log.warning("%s connect attempt %d failed: %s", label, attempt + 1, e)
+            if conn is not None:
+                _pool.release(conn, False)
+            continue
+        if resp.status != 200:
+            body = resp.read(512).decode(errors="replace")
+            log.error("%s API error %d: %s", label, resp.status, body)
+            _pool.release(conn, False)
+            return None
+        return conn, resp
+    return None
+
+
+def _finish_stream(
+    conn: http.client.HTTPConnection,
+    resp: http.client.HTTPResponse,
+    completed: bool,
+) -> None:
+    """Return conn to the pool if the stream ended cleanly, otherwise drop it."""
+    if completed:
+        try:
+            resp.read()  # drain trailing events / chunk terminator
+        except (http.client.HTTPException, OSError):
+            completed = False
+    _pool.release(conn, completed and not resp.will_close)
 
-def _reset_http() -> None:
-    global _http_conn
-    try:
-        if _http_conn:
-            _http_conn.close()
-    except Exception:
-        pass
-    _http_conn = None
+
+def _drain_events(
+    conn: http.client.HTTPConnection,
+    resp: http.client.HTTPResponse,
+    events: Iterator[bytes],
+) -> None:
+    """Read an Anthropic stream nobody is waiting on up to message_stop, then
+    hand conn to _finish_stream. Gives up on error or after DRAIN_TIMEOUT."""
+    completed = False
+    if not resp.will_close:
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        try:
+            conn.sock.settimeout(DRAIN_TIMEOUT)
+            for raw in events:
+                if time.monotonic() > deadline:
+                    break
+                try:
+                    data = _json_loads(raw)
+                except ValueError:
+                    continue
+                if data.get("type") == "message_stop":
+                    conn.sock.settimeout(LLM_TIMEOUT)
+                    completed = True
+                    break
+        except (http.client.HTTPException, OSError):
+            pass
+    _finish_stream(conn, resp, completed)
+
+
+# ---------------------------------------------------------------------------
+# LLM streaming (runs in thread executor)
+# ---------------------------------------------------------------------------
+def _sse_data(resp: http.client.HTTPResponse) -> Iterator[bytes]:
+    """Yield the payload of each SSE `data: ` line as raw bytes.
+
+    Pulls whatever has arrived with read1() and splits lines with
+    bytearray.find, instead of a readline() round trip per event.
+    """
+    buf = bytearray()
+    while True:
+        chunk = resp.read1(4096)
+        if not chunk:
+            return
+        buf += chunk
+        start = 0
+        while (nl := buf.find(b"\n", start)) != -1:
+            if buf.startswith(b"data: ", start):
+                yield bytes(buf[start + 6:nl]).rstrip(b"\r")
+            start = nl + 1
+        del buf[:start]
 
 
 def _clean_line(line: str) -> str | None:
     """Strip shell prompt prefix and markdown artifacts. Returns None if invalid."""
     line = line.strip().lstrip("$").strip(" `")
-    if not line:
-        return None
-    if line.startswith("#") or line.startswith("```"):
+    # Empty, comment or markdown fence
+    if not line or line[0] in "#`":
         return None
     # Skip single-char or pure-punctuation lines
-    if len(line) <= 2 and not line[0:1].isalpha():
+    if len(line) <= 2 and not line[:1].isalpha():
         return None
-    # Drop lines with unbalanced quotes (likely truncated)
-    if line.count('"') % 2 != 0 or line.count("'") % 2 != 0:
+    # Drop lines with unbalanced quotes (likely truncated); str.count runs in C
+    if line.count('"') & 1 or line.count("'") & 1:
         return None
     return line
 
 
 def _llm_stream(
-    prompt: str,
+    payload: bytes,
     emit: Callable[[str], None],
     stop: threading.Event,
 ) -> None:
     """Stream command lines from llama.cpp, calling emit() for each complete line.
     Runs synchronously in a thread; uses stop event for early termination."""
-    payload = json.dumps({
-        "prompt": prompt,
-        "temperature": 0.7,
-        "n_predict": 250,
-        "stop": ["Request:", "Past commands:"],
-        "stream": True,
-        "cache_prompt": True,
-    }).encode()
-    headers = {
-        "Content-Type": "application/json",
-        "Content-Length": str(len(payload)),
-    }
-
     buf  = ""
     seen: set[str] = set()
     count = 0
 
+    opened = _open_stream(LLAMA_HOST, LLAMA_PORT, False, "/completion", payload, {}, "LLM")
+    if opened is None:
+        return
+    conn, resp = opened
+    completed = False
+
     try:
-        for attempt in range(2):
+        for raw in _sse_data(resp):
             try:
-                conn = _get_http()
-                conn.request("POST", "/completion", body=payload, headers=headers)
-                resp = conn.getresponse()
-                break
-            except (http.client.HTTPException, OSError) as e:
-                log.warning("LLM connect attempt %d failed: %s", attempt + 1, e)
-                _reset_http()
-                if attempt == 1:
-                    return
-
-        while count < 5 and not stop.is_set():
-            raw = resp.readline()
-            if not raw:
-                break
-            raw = raw.decode("utf-8", errors="replace").strip()
-            if not raw.startswith("data: "):
-                continue
-            try:
-                data = json.loads(raw[6:])
-            except json.JSONDecodeError:
+                data = _json_loads(raw)
+            except ValueError:
                 continue
 
             buf += data.get("content", "")
@@ -252,6 +472,11 @@ def _llm_stream(
                     log.info("Emitted command %d: %r", count, cleaned)
 
             if data.get("stop"):
+                completed = True
+                break
+            # Closing mid-stream makes llama-server stop generating, which is
+            # worth more than keeping a loopback connection
+            if count >= 5 or stop.is_set():
                 break
 
         # Flush any remaining partial line on stop token
@@ -263,66 +488,57 @@ def _llm_stream(
 
     except Exception as e:
         log.error("LLM stream error: %s", e)
-        _reset_http()
+        completed = False
+    finally:
+        _finish_stream(conn, resp, completed)
 
 
 # ---------------------------------------------------------------------------
 # Anthropic backend
 # ---------------------------------------------------------------------------
-_anthropic_conn: http.client.HTTPSConnection | None = None
+ANTHROPIC_HOST = "api.anthropic.com"
+ANTHROPIC_PORT = 443
+
+# Keep the TLS connection across typing pauses; the API keeps idle connections
+# open far longer than llama-server, and _open_stream retries on a new
+# connection if it was closed after all.
+ANTHROPIC_IDLE_TIMEOUT = 60.0
+_pool.set_idle_timeout(ANTHROPIC_HOST, ANTHROPIC_PORT, ANTHROPIC_IDLE_TIMEOUT)
+
+
+_ANTHROPIC_SYSTEM = (
+    "You generate shell commands from natural language descriptions. "
+    "Output exactly 5 different commands, one per line. "
+    "Each must use a different tool or approach. "
+    "Valid bash/zsh only. No numbering, no explanations, no markdown. "
+    "Always quote URLs and arguments containing special characters (?, &, =, spaces)."
+)
 
 
-def _get_anthropic_conn() -> http.client.HTTPSConnection:
-    global _anthropic_conn
-    if _anthropic_conn is None:
-        _anthropic_conn = http.client.HTTPSConnection(
-            "api.anthropic.com", timeout=LLM_TIMEOUT
-        )
-    return _anthropic_conn
+_ANTHROPIC_HEAD, _ANTHROPIC_TAIL = _json_template({
+    "model": ANTHROPIC_MODEL,
+    "max_tokens": 250,
+    "system": _ANTHROPIC_SYSTEM,
+    "messages": "__MESSAGES__",
+    "stream": True,
+}, "__MESSAGES__")
 
 
-def _reset_anthropic_conn() -> None:
-    global _anthropic_conn
-    try:
-        if _anthropic_conn:
-            _anthropic_conn.close()
-    except Exception:
-        pass
-    _anthropic_conn = None
-
-
-def _build_anthropic_messages(query: str, examples: list[str]) -> tuple[str, list[dict]]:
-    system = (
-        "You generate shell commands from natural language descriptions. "
-        "Output exactly 5 different commands, one per line. "
-        "Each must use a different tool or approach. "
-        "Valid bash/zsh only. No numbering, no explanations, no markdown. "
-        "Always quote URLs and arguments containing special characters (?, &, =, spaces)."
-    )
+def _build_anthropic_payload(query: str, examples: list[str]) -> bytes:
     history = "\n".join(f"$ {e}" for e in examples)
     user_content = (f"Relevant past commands for context:\n{history}\n\n" if examples else "")
     user_content += f"Request: {query}\nCommands:"
-    return system, [{"role": "user", "content": user_content}]
+    messages = json.dumps([{"role": "user", "content": user_content}])
+    return _ANTHROPIC_HEAD + messages.encode() + _ANTHROPIC_TAIL
 
 
 def _llm_stream_anthropic(
-    query: str,
-    examples: list[str],
+    payload: bytes,
     emit: Callable[[str], None],
     stop: threading.Event,
 ) -> None:
     """Stream command lines from Anthropic API, calling emit() for each complete line."""
-    system, messages = _build_anthropic_messages(query, examples)
-    payload = json.dumps({
-        "model": ANTHROPIC_MODEL,
-        "max_tokens": 250,
-        "system": system,
-        "messages": messages,
-        "stream": True,
-    }).encode()
     headers = {
-        "Content-Type": "application/json",
-        "Content-Length": str(len(payload)),
         "x-api-key": ANTHROPIC_API_KEY,
         "anthropic-version": "2023-06-01",
     }
@@ -333,51 +549,41 @@ def _llm_stream_anthropic(
     input_tokens = 0
     output_tokens = 0
 
+    opened = _open_stream(
+        ANTHROPIC_HOST, ANTHROPIC_PORT, True, "/v1/messages", payload, headers, "Anthropic"
+    )
+    if opened is None:
+        return
+    conn, resp = opened
+    completed = False
+    draining = False
+
     try:
-        for attempt in range(2):
-            try:
-                conn = _get_anthropic_conn()
-                conn.request("POST", "/v1/messages", body=payload, headers=headers)
-                resp = conn.getresponse()
-                if resp.status != 200:
-                    body = resp.read(512).decode(errors="replace")
-                    log.error("Anthropic API error %d: %s", resp.status, body)
-                    _reset_anthropic_conn()
-                    return
-                break
-            except (http.client.HTTPException, OSError) as e:
-                log.warning("Anthropic connect attempt %d failed: %s", attempt + 1, e)
-                _reset_anthropic_conn()
-                if attempt == 1:
-                    return
-
-        while count < 5 and not stop.is_set():
-            raw = resp.readline()
-            if not raw:
-                break
-            raw = raw.decode("utf-8", errors="replace").strip()
-            if not raw.startswith("data: "):
-                continue
-            data_str = raw[6:]
-            if data_str == "[DONE]":
+        events = _sse_data(resp)
+        for raw in events:
+            if raw == b"[DONE]":
+                completed = True
                 break
             try:
-                data = json.loads(data_str)
-            except json.JSONDecodeError:
+                data = _json_loads(raw)
+            except ValueError:
                 continue
 
-            t = data.get("type")
-            if t == "message_start":
+            # Nearly every event is a text delta: test it first and index its
+            # fields directly; the once-per-stream events keep defensive .get()s.
+            t = data["type"]
+            if t == "content_block_delta":
+                delta = data["delta"]
+                if delta["type"] == "text_delta":
+                    buf += delta["text"]
+            elif t == "message_start":
                 usage = data.get("message", {}).get("usage", {})
                 input_tokens = usage.get("input_tokens", 0)
-            elif t == "content_block_delta":
-                delta = data.get("delta", {})
-                if delta.get("type") == "text_delta":
-                    buf += delta.get("text", "")
             elif t == "message_delta":
                 usage = data.get("usage", {})
                 output_tokens = usage.get("output_tokens", 0)
             elif t == "message_stop":
+                completed = True
                 break
 
             while "\n" in buf and count < 5:
@@ -389,6 +595,12 @@ def _llm_stream_anthropic(
                     count += 1
                     log.info("Emitted command %d (anthropic): %r", count, cleaned)
 
+            if stop.is_set():
+                break
+            if count >= 5:
+                draining = True
+                break
+
         # Flush any trailing partial line
         if buf.strip() and count < 5 and not stop.is_set():
             cleaned = _clean_line(buf)
@@ -401,7 +613,14 @@ def _llm_stream_anthropic(
 
     except Exception as e:
         log.error("Anthropic stream error: %s", e)
-        _reset_anthropic_conn()
+        completed = draining = False
+    finally:
+        if draining:
+            # The client has its five commands; let it see EOF now and read
+            # the rest off the request path
+            _llm_executor.submit(_drain_events, conn, resp, events)
+        else:
+            _finish_stream(conn, resp, completed)
 
 
 # ---------------------------------------------------------------------------
@@ -442,49 +661,73 @@ async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) ->
             return
 
         log.info("Query: %r (backend: %s)", query, BACKEND)
+        loop = asyncio.get_running_loop()
+        use_anthropic = BACKEND == "anthropic" and bool(ANTHROPIC_API_KEY)
+
+        # Open the LLM connection (TCP + TLS for Anthropic) while FTS runs
+        if use_anthropic:
+            warm = loop.run_in_executor(
+                _llm_executor, _pool.warm, ANTHROPIC_HOST, ANTHROPIC_PORT, True
+            )
+        else:
+            warm = loop.run_in_executor(_llm_executor, _pool.warm, LLAMA_HOST, LLAMA_PORT)
+
         examples = await fts_query(query)
         log.info("FTS5 examples: %r", examples)
 
-        # Bridge: thread calls emit() → asyncio queue → writer
-        loop = asyncio.get_running_loop()
-        queue: asyncio.Queue[str | None] = asyncio.Queue()
+        # Bridge: thread calls emit() → write scheduled on the loop thread.
+        # `done` resolves when the producer returns, the client goes away or
+        # no line arrives within LLM_TIMEOUT (watchdog re-armed per line).
+        done: asyncio.Future[None] = loop.create_future()
         stop  = threading.Event()
+        watchdog: asyncio.TimerHandle | None = None
+
+        def finish() -> None:
+            if not done.done():
+                done.set_result(None)
+
+        def on_timeout() -> None:
+            log.warning("Timed out waiting for next command from LLM")
+            finish()
+
+        def arm_watchdog() -> None:
+            nonlocal watchdog
+            if watchdog is not None:
+                watchdog.cancel()
+            watchdog = loop.call_later(LLM_TIMEOUT, on_timeout)
+
+        def write(data: bytes) -> None:
+            if done.done():
+                return
+            if writer.is_closing():
+                finish()
+                return
+            writer.write(data)
+            arm_watchdog()
 
         def emit(cmd: str) -> None:
-            loop.call_soon_threadsafe(queue.put_nowait, cmd)
+            loop.call_soon_threadsafe(write, (cmd + "\n").encode())
 
-        if BACKEND == "anthropic" and ANTHROPIC_API_KEY:
-            def produce() -> None:
-                try:
-                    _llm_stream_anthropic(query, examples, emit, stop)
-                finally:
-                    loop.call_soon_threadsafe(queue.put_nowait, None)
+        if use_anthropic:
+            stream, payload = _llm_stream_anthropic, _build_anthropic_payload(query, examples)
         else:
-            prompt = _build_prompt(query, examples)
-            def produce() -> None:
-                try:
-                    _llm_stream(prompt, emit, stop)
-                finally:
-                    loop.call_soon_threadsafe(queue.put_nowait, None)
+            stream, payload = _llm_stream, _build_payload(query, tuple(examples))
+
+        def produce() -> None:
+            try:
+                stream(payload, emit, stop)
+            finally:
+                loop.call_soon_threadsafe(finish)
 
-        future = loop.run_in_executor(_executor, produce)
+        await warm
+        future = loop.run_in_executor(_llm_executor, produce)
+        arm_watchdog()
 
         try:
-            while True:
-                try:
-                    item = await asyncio.wait_for(queue.get(), timeout=LLM_TIMEOUT)
-                except asyncio.TimeoutError:
-                    log.warning("Timed out waiting for next command from LLM")
-                    break
-                if item is None:
-                    break
-                writer.write((item + "\n").encode())
-                await writer.drain()
-        except asyncio.CancelledError:
-            stop.set()
-            raise
+            await done
         finally:
             stop.set()
+            watchdog.cancel()
             try:
                 writer.write_eof()
             except Exception:
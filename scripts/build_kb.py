@@ -7,72 +7,61 @@ Usage:
 """
 
 import argparse
+import itertools
+import mmap
 import os
 import re
 import sqlite3
 import sys
 from pathlib import Path
+from typing import Iterable, Iterator
 
 DEFAULT_HISTORY = Path.home() / ".zsh_history"
 DEFAULT_DB = Path.home() / ".local/share/zsh-ai-autocomplete/history.db"
 
-# Extended zsh history format: `: timestamp:elapsed;command`
-_EXTENDED_RE = re.compile(r"^: \d+:\d+;(.+)$")
+# One history record per match: optional extended-format prefix
+# `: timestamp:elapsed;`, then the command up to an unescaped newline.
+# Backslash pairs (including backslash-newline continuations) are consumed
+# inside the command, so multi-line entries come back as a single match.
+_RECORD_RE = re.compile(rb"^(?:: \d+:\d+;)?([^\n\\]*(?:\\.[^\n\\]*)*)", re.M | re.S)
 
 
-def parse_history(path: Path) -> list[str]:
+def parse_history(path: Path) -> Iterator[str]:
     """Parse zsh history file, handling both plain and extended formats.
 
     Extended format lines may be continued with a trailing backslash across
     multiple physical lines; we join them into a single logical command.
+    The file is memory-mapped and commands are yielded lazily.
     """
-    commands: list[str] = []
     try:
-        raw = path.read_bytes()
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size == 0:
+                return
+            mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
     except OSError as e:
         print(f"Error reading history file: {e}", file=sys.stderr)
-        return commands
-
-    # Decode with surrogate-escape so we don't crash on non-UTF-8 bytes
-    text = raw.decode("utf-8", errors="surrogateescape")
-
-    # Join physical continuation lines (trailing backslash)
-    logical_lines: list[str] = []
-    buf = ""
-    for line in text.splitlines():
-        if line.endswith("\\"):
-            buf += line[:-1] + " "
-        else:
-            buf += line
-            logical_lines.append(buf)
-            buf = ""
-    if buf:
-        logical_lines.append(buf)
-
-    for line in logical_lines:
-        m = _EXTENDED_RE.match(line)
-        if m:
-            cmd = m.group(1).strip()
-        else:
-            cmd = line.strip()
-
-        # Skip comments and very short commands
-        if not cmd or cmd.startswith("#") or len(cmd) < 3:
-            continue
-        commands.append(cmd)
-
-    return commands
-
-
-def normalize(cmd: str) -> str:
-    """Collapse runs of whitespace to a single space and strip surrogates."""
-    # Remove surrogate-escaped bytes that SQLite cannot store
-    cmd = cmd.encode("utf-8", errors="ignore").decode("utf-8")
-    return " ".join(cmd.split())
-
-
-def build_db(db_path: Path, commands: list[str]) -> None:
-    """Create (or rebuild) the FTS5 database from a list of commands."""
+        return
+
+    with mm:
+        for m in _RECORD_RE.finditer(mm):
+            raw = m.group(1)
+            if b"\\\n" in raw:
+                raw = raw.replace(b"\\\n", b" ")
+            # Non-UTF-8 bytes become U+FFFD, which SQLite stores as ordinary
+            # text; collapse whitespace runs so dedup ignores spacing.
+            cmd = " ".join(raw.decode("utf-8", errors="replace").split())
+
+            # Skip comments and very short commands
+            if not cmd or cmd.startswith("#") or len(cmd) < 3:
+                continue
+            yield cmd
+
+
+def build_db(db_path: Path, commands: Iterable[str]) -> None:
+    """Create (or rebuild) the FTS5 database from an iterable of commands."""
     db_path.parent.mkdir(parents=True, exist_ok=True)
 
     # Remove stale DB so we start fresh on --rebuild
@@ -81,27 +70,29 @@ def build_db(db_path: Path, commands: list[str]) -> None:
 
     con = sqlite3.connect(str(db_path))
     try:
-        con.execute("PRAGMA journal_mode=WAL")
-        con.execute("PRAGMA synchronous=NORMAL")
+        # The file is rebuilt from scratch on failure, so skip journaling/fsync
+        con.execute("PRAGMA journal_mode=MEMORY")
+        con.execute("PRAGMA synchronous=OFF")
+        con.execute("PRAGMA cache_size=-65536")  # 64 MiB
+        con.execute("PRAGMA temp_store=MEMORY")
+        con.execute("PRAGMA mmap_size=268435456")
         con.execute(
             "CREATE VIRTUAL TABLE IF NOT EXISTS commands "
-            "USING fts5(cmd, tokenize='porter unicode61')"
+            "USING fts5(cmd, tokenize='porter unicode61 remove_diacritics 2', prefix='2 3 4')"
         )
-
-        # Deduplicate while preserving order (last-seen wins position)
-        seen: set[str] = set()
-        unique: list[str] = []
-        for cmd in commands:
-            norm = normalize(cmd)
-            if norm not in seen:
-                seen.add(norm)
-                unique.append(norm)
-
-        con.executemany("INSERT INTO commands(cmd) VALUES (?)", [(c,) for c in unique])
-        con.execute("INSERT INTO commands(commands) VALUES('optimize')")
+        con.execute("CREATE TEMP TABLE tmp(cmd TEXT)")
+
+        con.execute("BEGIN IMMEDIATE")
+        con.executemany("INSERT INTO tmp VALUES (?)", ((c,) for c in commands))
+        # Deduplicate in SQLite instead of Python
+        cur = con.execute("INSERT INTO commands(cmd) SELECT DISTINCT cmd FROM tmp")
+        unique = cur.rowcount
+        # A bounded incremental merge is enough for the read-only daemon and
+        # avoids rewriting the whole index the way 'optimize' does.
+        con.execute("INSERT INTO commands(commands, rank) VALUES('merge', 500)")
         con.commit()
         print(
-            f"Built knowledge base: {len(unique)} unique commands → {db_path}",
+            f"Built knowledge base: {unique} unique commands → {db_path}",
             file=sys.stderr,
         )
     finally:
@@ -138,11 +129,12 @@ def main() -> None:
         sys.exit(1)
 
     commands = parse_history(args.history)
-    if not commands:
+    first = next(commands, None)
+    if first is None:
         print("No commands parsed from history file.", file=sys.stderr)
         sys.exit(1)
 
-    build_db(args.db, commands)
+    build_db(args.db, itertools.chain((first,), commands))
 
 
 if __name__ == "__main__":